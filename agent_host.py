@@ -0,0 +1,343 @@
+import gc
+import multiprocessing
+import statistics
+import struct
+import time
+import timeit
+
+import numpy as np
+from connect4 import Connect4
+
+# control message: opcode, request sequence number, value (budget or move)
+_MSG = struct.Struct('<BId')
+# search payload header: player to move, last move (-1, -1 if none)
+_STATE = struct.Struct('<bbb')
+# appended to DONE messages: CPU time of the search in the worker
+_CPU = struct.Struct('<d')
+
+READY, PING, PONG, SEARCH, BEST, DONE, ERROR, STOP = range(8)
+
+
+def time_millis():
+    return 1000 * timeit.default_timer()
+
+
+def encode_state(game):
+    '''
+    Packs the position into a compact byte string: a 3 byte header followed
+    by one int8 per cell.
+
+    Parameters
+    ----------
+    game : `connect4.Connect4`
+        An instance of `connect4.Connect4` encoding the current state of the game.
+
+    Returns
+    -------
+    bytes
+        The encoded position.
+    '''
+
+    x, y = game.last_move if game.last_move is not None else (-1, -1)
+    header = _STATE.pack(game.player, x, y)
+    return header + game.state.astype(np.int8).tobytes()
+
+
+def decode_state(buf, size, N):
+    '''
+    Rebuilds a game from the output of `encode_state`.
+
+    Parameters
+    ----------
+    buf : bytes
+        The encoded position.
+
+    size : tuple
+        Board width and height.
+
+    N : int
+        Number of pieces in a row needed to win.
+
+    Returns
+    -------
+    `connect4.Connect4`
+        The decoded game.
+    '''
+
+    player, x, y = _STATE.unpack_from(buf)
+    board = np.frombuffer(buf, dtype=np.int8, offset=_STATE.size).reshape(size)
+    last_move = (x, y) if x >= 0 else None
+    return Connect4.from_board(board, player, last_move, N)
+
+
+def _worker_main(conn, player, size, N, warmup_millis):
+    '''
+    Worker process loop. Runs one warm-up search, then answers search
+    requests until the pipe is closed or a STOP message arrives.
+    '''
+
+    def run_search(game, budget, report):
+        start = time_millis()
+        time_left = lambda: budget - (time_millis() - start)
+        player.report_move = report
+        move = player.search(game, time_left)
+        return -1 if move is None else move
+
+    try:
+        run_search(Connect4(size, N), warmup_millis, None)
+    except Exception:
+        pass
+    gc.collect()
+    conn.send_bytes(_MSG.pack(READY, 0, 0.))
+
+    while True:
+        try:
+            buf = conn.recv_bytes()
+        except (EOFError, OSError):
+            break
+
+        op, seq, value = _MSG.unpack_from(buf)
+        if op == STOP:
+            break
+
+        if op == PING:
+            conn.send_bytes(_MSG.pack(PONG, seq, 0.))
+            continue
+
+        if op == SEARCH:
+            game = decode_state(buf[_MSG.size:], size, N)
+            report = lambda move: conn.send_bytes(_MSG.pack(BEST, seq, move))
+            try:
+                cpu_start = time.process_time()
+                move = run_search(game, value, report)
+                cpu = 1000 * (time.process_time() - cpu_start)
+                conn.send_bytes(_MSG.pack(DONE, seq, move) + _CPU.pack(cpu))
+            except Exception:
+                conn.send_bytes(_MSG.pack(ERROR, seq, 0.))
+
+            # collect garbage between turns rather than during the next search
+            gc.collect()
+
+
+class AgentHost:
+    def __init__(self, player, size=(7, 6), N=4, warmup_millis=50.,
+                 startup_timeout=10., safety_millis=1., start_method=None):
+        '''
+        Runs a player in its own long-lived worker process so that a slow or
+        hung agent cannot stall the game, and garbage collection in one agent
+        does not eat into the other agent's turn.
+
+        Positions are sent to the worker as compact int8 byte strings. The
+        worker may report intermediate results through `player.report_move`;
+        if the worker misses the deadline the last reported move is used, or
+        the move is forfeited if there is none.
+
+        Params
+        ----------
+        player : object
+            The agent to host. Must implement `search(game, time_left)` and be
+            picklable.
+
+        size : tuple (optional)
+            Board width and height of the games the agent will play.
+
+        N : int (optional)
+            Number of pieces in a row needed to win.
+
+        warmup_millis : float (optional)
+            Time budget of the warm-up search run when the worker starts.
+
+        startup_timeout : float (optional)
+            Seconds to wait for the worker to finish warming up.
+
+        safety_millis : float (optional)
+            Margin kept between the host deadline and the time limit.
+
+        start_method : str (optional)
+            The `multiprocessing` start method; platform default if None.
+        '''
+
+        self.player = player
+        self.size = tuple(size)
+        self.N = N
+        self.warmup_millis = warmup_millis
+        self.startup_timeout = startup_timeout
+        self.safety_millis = safety_millis
+        self.start_method = start_method
+        self.overhead_millis = 0.
+        # worker CPU time of the last move, None if it missed the deadline
+        self.last_cpu_millis = None
+        self._seq = 0
+        self._dead = False
+        self._process = None
+        self._conn = None
+        self.start()
+
+    def __repr__(self):
+        return 'AgentHost({!r})'.format(self.player)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        '''
+        Starts and warms up the worker process, then measures the IPC overhead.
+        '''
+
+        ctx = multiprocessing.get_context(self.start_method)
+        self._conn, child = ctx.Pipe()
+        self._process = ctx.Process(
+            target=_worker_main,
+            args=(child, self.player, self.size, self.N, self.warmup_millis),
+            daemon=True)
+        self._process.start()
+        child.close()
+        self._dead = False
+
+        # a worker that dies while starting closes the pipe, which poll reports as ready
+        try:
+            ready = self._conn.poll(self.startup_timeout)
+            op = _MSG.unpack_from(self._conn.recv_bytes())[0] if ready else None
+        except (EOFError, OSError):
+            op = None
+
+        if op != READY:
+            self.close()
+            raise RuntimeError('Agent worker for {!r} did not start'.format(self.player))
+
+        self.overhead_millis = self.measure_overhead()
+
+    def close(self):
+        '''
+        Stops the worker process.
+        '''
+
+        if self._process is None:
+            return
+
+        try:
+            self._conn.send_bytes(_MSG.pack(STOP, 0, 0.))
+        except (BrokenPipeError, OSError):
+            pass
+
+        self._process.join(timeout=.5)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+
+        self._conn.close()
+        self._process = None
+        self._conn = None
+
+    def restart(self):
+        self.close()
+        self.start()
+
+    def measure_overhead(self, rounds=20):
+        '''
+        Measures the median round-trip time of an empty message to the worker.
+
+        Parameters
+        ----------
+        rounds : int (optional)
+            The number of round trips to time.
+
+        Returns
+        -------
+        float
+            The round-trip time in milliseconds.
+        '''
+
+        samples = []
+        for _ in range(rounds):
+            self._seq += 1
+            start = time_millis()
+            self._conn.send_bytes(_MSG.pack(PING, self._seq, 0.))
+            while True:
+                op, seq, _ = _MSG.unpack_from(self._conn.recv_bytes())
+                if op == PONG and seq == self._seq:
+                    break
+
+            samples.append(time_millis() - start)
+
+        return statistics.median(samples)
+
+    def settle(self):
+        '''
+        Replaces a worker that died or was stopped for missing its deadline.
+        Call this before each `hosted_move`, outside the move's time budget.
+        '''
+
+        if self._dead:
+            self.restart()
+
+    def hosted_move(self, game, time_limit):
+        '''
+        Asks the worker for a move and enforces a hard deadline. Never blocks
+        past the deadline. A worker still searching at the deadline is
+        stopped at once so it cannot use CPU during the opponent's turn; it
+        is replaced by the next `settle`.
+
+        Parameters
+        ----------
+        game : `connect4.Connect4`
+            An instance of `connect4.Connect4` encoding the current state of the game.
+
+        time_limit : float
+            Milliseconds available for the move, IPC included.
+
+        Returns
+        -------
+        int or None
+            The move found by the agent, or its last reported move if it ran
+            out of time; None if the move is forfeited.
+        '''
+
+        start = time_millis()
+        self.last_cpu_millis = None
+        self._seq += 1
+        deadline = start + time_limit - self.safety_millis
+        budget = time_limit - self.safety_millis - self.overhead_millis
+        message = _MSG.pack(SEARCH, self._seq, budget) + encode_state(game)
+        try:
+            self._conn.send_bytes(message)
+        except (BrokenPipeError, OSError):
+            self._dead = True
+            return None
+
+        searching = True
+        best = None
+        while True:
+            remaining = deadline - time_millis()
+            try:
+                if remaining <= 0 or not self._conn.poll(remaining / 1000):
+                    break
+                buf = self._conn.recv_bytes()
+                op, seq, value = _MSG.unpack_from(buf)
+            except (EOFError, OSError):
+                # worker died, settle() replaces it before the next move
+                self._dead = True
+                break
+
+            if seq != self._seq:
+                continue
+
+            if op == BEST:
+                best = int(value)
+
+            elif op == DONE:
+                self.last_cpu_millis, = _CPU.unpack_from(buf, _MSG.size)
+                return int(value)
+
+            elif op == ERROR:
+                searching = False
+                break
+
+        if searching and not self._dead:
+            self._process.terminate()
+            self._dead = True
+
+        return best
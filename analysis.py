@@ -0,0 +1,605 @@
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+from collections import OrderedDict
+
+import numpy as np
+from agent_host import decode_state, encode_state, time_millis
+from connect4 import Connect4
+from test_agent import MinimaxPlayer, SearchTimeout
+from utils import get_lines, in_a_row
+
+DEFAULT_PORT = 8765
+DEFAULT_TIME_MILLIS = 250.
+# positions are sent to the pool as int8 coordinates, see `agent_host.encode_state`
+MAX_SIDE = 127
+
+# one searcher per pool process, created on first use
+_searcher = None
+
+
+def parse_position(request):
+    '''
+    Builds a game from an analysis request.
+
+    Parameters
+    ----------
+    request : dict
+        Either `moves`, a string of 1-based column digits (e.g. "4453") or a
+        list of 1-based columns, or `board`, a (w, h) nested list of 0/1/-1
+        values. `size` and `N` are optional and default to a standard game;
+        each side of `size` may be at most `MAX_SIDE`.
+
+    Returns
+    -------
+    `connect4.Connect4`
+        The game at the requested position.
+    '''
+
+    size = request.get('size', (7, 6))
+    N = request.get('N', 4)
+    if not isinstance(size, (list, tuple)) or len(size) != 2 or \
+            not all(_is_int(side) and 1 <= side <= MAX_SIDE for side in size):
+        raise ValueError('Size must be two integers between 1 and {}'.format(MAX_SIDE))
+    if not _is_int(N):
+        raise ValueError('N must be an integer')
+    size = tuple(size)
+
+    if 'moves' in request:
+        moves = request['moves']
+        if isinstance(moves, str):
+            moves = [int(c) for c in moves]
+
+        game = Connect4(size, N)
+        for col in moves:
+            if game.score is not None:
+                raise ValueError('Game is already over')
+            if not 1 <= col <= game.w or not game.move(col - 1):
+                raise ValueError('Illegal move {}'.format(col))
+
+    elif 'board' in request:
+        board = np.array(request['board'])
+        if board.shape != size:
+            raise ValueError('Board shape {} does not match size {}'.format(board.shape, size))
+        if not np.all(np.isin(board, (-1, 0, 1))):
+            raise ValueError('Board values must be 0, 1 or -1')
+
+        heights = np.count_nonzero(board, axis=1)
+        for x in range(size[0]):
+            if np.any(board[x, heights[x]:] != 0):
+                raise ValueError('Column {} has a gap under a piece'.format(x + 1))
+
+        # player 1 always moves first
+        balance = np.sum(board)
+        if balance not in (0, 1):
+            raise ValueError('Players cannot have {} and {} pieces'.format(
+                np.sum(board == 1), np.sum(board == -1)))
+        if board_winner(board, N) is not None:
+            raise ValueError('Game is already over')
+
+        # without a winner, any top piece of the last player is a consistent last move
+        player = 1 if balance == 0 else -1
+        last_move = None
+        for x in range(size[0]):
+            y = heights[x] - 1
+            if y >= 0 and board[x, y] == -player:
+                last_move = (x, int(y))
+                break
+
+        game = Connect4.from_board(board, player, last_move, N)
+
+    else:
+        raise ValueError('Request needs either moves or a board')
+
+    if game.score is not None or not game.available_moves:
+        raise ValueError('Game is already over')
+
+    return game
+
+
+def board_winner(board, N):
+    '''
+    Checks every line of the board for N pieces in a row.
+
+    Returns
+    -------
+    int or None
+        The winning player, or None if nobody has won.
+    '''
+
+    for x, y in zip(*np.nonzero(board)):
+        player = board[x, y]
+        for line in get_lines(board, (x, y)):
+            if in_a_row(line, N, player):
+                return int(player)
+    return None
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def parse_limits(request):
+    '''
+    Reads the optional `depth` and `time` limits of an analysis request.
+
+    Returns
+    -------
+    tuple
+        The depth (a positive integer) and time in milliseconds (a positive
+        number); either may be None.
+    '''
+
+    depth = request.get('depth')
+    time_limit = request.get('time')
+    if depth is not None and (not _is_int(depth) or depth < 1):
+        raise ValueError('Depth must be a positive integer')
+    if time_limit is not None and (not (_is_int(time_limit) or isinstance(time_limit, float))
+                                   or not 0 < time_limit < math.inf):
+        raise ValueError('Time must be a positive number of milliseconds')
+    return depth, time_limit
+
+
+def position_key(game):
+    return (game.size, game.N, game.player, game.state.astype(np.int8).tobytes())
+
+
+def evaluate(player, game):
+    '''
+    Scores a position from player 1's point of view. Finished games score
+    +/-inf for a win and 0 for a draw; other positions use `player.score`,
+    which rates the position for the side to move.
+    '''
+
+    if game.score is not None:
+        return game.score * float('inf') if game.score else 0.
+    return game.player * player.score(game)
+
+
+def minimax(player, game, depth, alpha, beta):
+    '''
+    Alpha-beta search scored from player 1's point of view: player 1
+    maximises and player -1 minimises. Unlike `MinimaxPlayer.min_value`
+    and `max_value`, the search stops at won positions.
+    '''
+
+    if player.time_left() < player.TIMER_THRESHOLD:
+        raise SearchTimeout()
+
+    if depth == 0 or game.score is not None:
+        return evaluate(player, game)
+
+    maximising = game.player == 1
+    best = float('-inf') if maximising else float('inf')
+    for action in game.available_moves:
+        util = minimax(player, game.sim_move(action), depth-1, alpha, beta)
+        if maximising:
+            best = max(best, util)
+            alpha = max(alpha, best)
+        else:
+            best = min(best, util)
+            beta = min(beta, best)
+        if alpha >= beta:
+            break
+    return best
+
+
+def root_search(player, game, depth):
+    '''
+    Finds the best move for the side to move, trying the moves in a fixed
+    order so that equal positions always give the same answer.
+
+    Returns
+    -------
+    tuple
+        The best move and its score from the point of view of the side to
+        move: positive is good for the player making the move.
+    '''
+
+    best_score = float('-inf')
+    best_move = -1
+    for action in game.available_moves:
+        child = game.sim_move(action)
+        # search the child with a window that only accepts improvements
+        if game.player == 1:
+            util = minimax(player, child, depth-1, best_score, float('inf'))
+        else:
+            util = -minimax(player, child, depth-1, float('-inf'), -best_score)
+        if util > best_score or best_move == -1:
+            best_score = util
+            best_move = action
+    return best_move, best_score
+
+
+def analyse_position(size, N, buf, depth=None, time_limit=None):
+    '''
+    Runs iterative deepening on an encoded position in a pool process.
+
+    Parameters
+    ----------
+    size : tuple
+        Board width and height.
+
+    N : int
+        Number of pieces in a row needed to win.
+
+    buf : bytes
+        The position, as encoded by `agent_host.encode_state`.
+
+    depth : int (optional)
+        Maximum search depth.
+
+    time_limit : float (optional)
+        Time budget in milliseconds.
+
+    Returns
+    -------
+    tuple
+        The best move, its score for the side to move (see `root_search`)
+        and the depth of the last completed search.
+    '''
+
+    global _searcher
+    if _searcher is None:
+        _searcher = MinimaxPlayer()
+
+    game = decode_state(buf, size, N)
+    start = time_millis()
+    if time_limit is None:
+        _searcher.time_left = lambda: float('inf')
+    else:
+        _searcher.time_left = lambda: time_limit - (time_millis() - start)
+
+    empty = game.w * game.h - game.n_moves
+    max_depth = empty if depth is None else min(depth, empty)
+    result = (game.available_moves[0], None, 0)
+    for d in range(1, max_depth + 1):
+        try:
+            move, score = root_search(_searcher, game, d)
+        except SearchTimeout:
+            break
+        result = (move, score, d)
+        # a forced result found at this depth is the quickest one
+        if math.isinf(score):
+            break
+
+    return result
+
+
+class AnalysisServer:
+    def __init__(self, workers=None, cache_size=10000, default_time=DEFAULT_TIME_MILLIS):
+        '''
+        Serves best-move analysis over newline-delimited JSON. Each connection
+        may pipeline any number of requests; responses carry the request `id`
+        and are sent as soon as they are ready, so they may arrive out of order.
+
+        Params
+        ----------
+        workers : int (optional)
+            Number of search processes; one per CPU if None.
+
+        cache_size : int (optional)
+            Number of results kept in the LRU cache.
+
+        default_time : float (optional)
+            Time budget in milliseconds for requests without `depth` or `time`.
+        '''
+
+        # spawned workers do not inherit the open client sockets, so closing
+        # a connection in the server really closes it. A spawn context Pool is
+        # used because ProcessPoolExecutor only accepts one from Python 3.7
+        self.pool = multiprocessing.get_context('spawn').Pool(workers)
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.default_time = default_time
+        # searches in progress, shared by identical requests
+        self.running = {}
+        self.connections = set()
+
+    async def serve(self, host='127.0.0.1', port=DEFAULT_PORT, path=None):
+        '''
+        Starts listening on a TCP port, or on a Unix socket if `path` is given.
+
+        Returns
+        -------
+        `asyncio.AbstractServer`
+            The running server.
+        '''
+
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle, path=path)
+        return await asyncio.start_server(self.handle, host, port)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def submit(self, *args):
+        '''
+        Runs `analyse_position` in the pool.
+
+        Returns
+        -------
+        `asyncio.Future`
+            Resolves to the result of `analyse_position`.
+        '''
+
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        # pool callbacks run in a pool thread, hand the result to the event loop
+        def resolve(set_value, value):
+            if not future.done():
+                set_value(value)
+
+        self.pool.apply_async(
+            analyse_position, args,
+            callback=lambda result: loop.call_soon_threadsafe(resolve, future.set_result, result),
+            error_callback=lambda e: loop.call_soon_threadsafe(resolve, future.set_exception, e))
+        return future
+
+    async def wait_closed(self):
+        # wait for open connections to finish their pending requests
+        if self.connections:
+            await asyncio.gather(*self.connections)
+
+    def handle(self, reader, writer):
+        task = asyncio.ensure_future(self.connection(reader, writer))
+        self.connections.add(task)
+        task.add_done_callback(self.connections.discard)
+
+    async def connection(self, reader, writer):
+        lock = asyncio.Lock()
+        tasks = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            tasks.append(asyncio.ensure_future(self.respond(line, writer, lock)))
+            tasks = [t for t in tasks if not t.done()]
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        writer.close()
+
+    async def respond(self, line, writer, lock):
+        request_id = None
+        try:
+            request = json.loads(line.decode())
+            request_id = request.get('id')
+            response = await self.analyse(request)
+        except Exception as e:
+            # anything a request triggers is reported, never left unanswered
+            response = {'error': str(e) or repr(e)}
+
+        response['id'] = request_id
+        writer.write((json.dumps(response, allow_nan=False) + '\n').encode())
+        async with lock:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+    async def analyse(self, request):
+        '''
+        Analyses one request, using the cache when possible.
+
+        Parameters
+        ----------
+        request : dict
+            The position (see `parse_position`) and optional `depth` and
+            `time` (milliseconds) limits.
+
+        Returns
+        -------
+        dict
+            The best `move` (0-based column), its `score`, the `depth` reached
+            and whether the result was `cached`. For a forced win or loss the
+            score is None and `result` is 'win' or 'loss'. Both `score` and
+            `result` are from the point of view of the side to move.
+        '''
+
+        game = parse_position(request)
+        depth, time_limit = parse_limits(request)
+        if depth is None and time_limit is None:
+            time_limit = self.default_time
+
+        key = position_key(game) + (depth, time_limit)
+        cached = key in self.cache
+        if cached:
+            self.cache.move_to_end(key)
+            result = self.cache[key]
+
+        elif key in self.running:
+            cached = True
+            result = await asyncio.shield(self.running[key])
+
+        else:
+            future = self.submit(game.size, game.N, encode_state(game), depth, time_limit)
+            self.running[key] = future
+            try:
+                result = await future
+            finally:
+                del self.running[key]
+
+            self.cache[key] = result
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        move, score, reached = result
+        # infinite scores are forced wins or losses and are not valid JSON
+        outcome = None
+        if score is not None and np.isinf(score):
+            outcome = 'win' if score > 0 else 'loss'
+            score = None
+
+        return {'move': move, 'score': score, 'result': outcome, 'depth': reached, 'cached': cached}
+
+
+class AnalysisClient:
+    def __init__(self):
+        '''
+        Client for `AnalysisServer`. Requests sent through the same client share
+        one connection and are pipelined.
+        '''
+
+        self.reader = None
+        self.writer = None
+        self.waiting = {}
+        self.next_id = 0
+        self.read_task = None
+
+    async def connect(self, host='127.0.0.1', port=DEFAULT_PORT, path=None):
+        if path is not None:
+            self.reader, self.writer = await asyncio.open_unix_connection(path)
+        else:
+            self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.read_task = asyncio.ensure_future(self.read())
+        return self
+
+    async def close(self):
+        self.writer.close()
+        if self.read_task is not None:
+            await self.read_task
+
+    async def read(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            response = json.loads(line.decode())
+            future = self.waiting.pop(response.pop('id'), None)
+            if future is not None and not future.done():
+                future.set_result(response)
+
+        for future in self.waiting.values():
+            if not future.done():
+                future.set_exception(ConnectionError('Analysis server closed the connection'))
+        self.waiting.clear()
+
+    async def request(self, request):
+        '''
+        Sends one request and waits for its response.
+
+        Parameters
+        ----------
+        request : dict
+            See `AnalysisServer.analyse`. Any `id` is replaced by the client.
+
+        Returns
+        -------
+        dict
+            The response; contains `error` if the request was rejected.
+        '''
+
+        self.next_id += 1
+        request = dict(request, id=self.next_id)
+        future = asyncio.get_event_loop().create_future()
+        self.waiting[self.next_id] = future
+        self.writer.write((json.dumps(request, allow_nan=False) + '\n').encode())
+        await self.writer.drain()
+        return await future
+
+    async def analyse(self, moves=None, board=None, depth=None, time=None, size=None, N=None):
+        request = {'moves': moves, 'board': board, 'depth': depth, 'time': time, 'size': size, 'N': N}
+        return await self.request({k: v for k, v in request.items() if v is not None})
+
+    async def analyse_many(self, requests):
+        '''
+        Pipelines many requests over the connection and returns the responses
+        in the same order.
+        '''
+
+        return await asyncio.gather(*(self.request(r) for r in requests))
+
+
+def read_requests(lines, depth=None, time_limit=None):
+    # each line is either a JSON request or a string of moves
+    requests = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        request = json.loads(line) if line.startswith('{') else {'moves': line}
+        if depth is not None:
+            request.setdefault('depth', depth)
+        if time_limit is not None:
+            request.setdefault('time', time_limit)
+        requests.append(request)
+    return requests
+
+
+async def bulk(args):
+    with open(args.input) as f:
+        requests = read_requests(f, args.depth, args.time)
+
+    server = None
+    if args.local:
+        analysis = AnalysisServer(args.workers, args.cache_size)
+        server = await analysis.serve(port=0)
+        client = await AnalysisClient().connect(port=server.sockets[0].getsockname()[1])
+    else:
+        client = await AnalysisClient().connect(args.host, args.port, args.unix)
+
+    responses = await client.analyse_many(requests)
+    await client.close()
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+        await analysis.wait_closed()
+        analysis.close()
+
+    with open(args.output, 'w') as f:
+        for request, response in zip(requests, responses):
+            response = dict(response, position=request.get('moves', request.get('board')))
+            f.write(json.dumps(response, allow_nan=False) + '\n')
+
+
+async def serve(args):
+    analysis = AnalysisServer(args.workers, args.cache_size)
+    server = await analysis.serve(args.host, args.port, args.unix)
+    print('Serving analysis on {}'.format(args.unix or '{}:{}'.format(args.host, args.port)))
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        analysis.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Connect4 position analysis.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', help='Unix socket path, used instead of TCP')
+    parser.add_argument('--workers', type=int, help='number of search processes')
+    parser.add_argument('--cache-size', type=int, default=10000)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    commands.add_parser('serve', help='run the analysis server')
+
+    bulk_parser = commands.add_parser('bulk', help='analyse every position in a file')
+    bulk_parser.add_argument('input', help='one moves string or JSON request per line')
+    bulk_parser.add_argument('output', help='JSON lines file for the results')
+    bulk_parser.add_argument('--depth', type=int)
+    bulk_parser.add_argument('--time', type=float, help='time limit per position in milliseconds')
+    bulk_parser.add_argument('--local', action='store_true',
+                             help='start a server in this process instead of connecting to one')
+
+    args = parser.parse_args(argv)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(serve(args) if args.command == 'serve' else bulk(args))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import timeit
+import tracemalloc
+from copy import copy
+
+from connect4 import Connect4
+
+
+def build_tree(game, depth):
+    '''
+    Expands every move sequence up to `depth` plies, like a full-width search
+    would, and keeps every node alive.
+
+    Returns
+    -------
+    list
+        All `connect4.Connect4` instances in the tree, root included.
+    '''
+
+    nodes = [game]
+    frontier = [game]
+    for _ in range(depth):
+        children = []
+        for node in frontier:
+            if node.score is None:
+                children.extend(node.sim_move(x) for x in node.available_moves)
+        nodes.extend(children)
+        frontier = children
+    return nodes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Connect4 state memory and copy-time benchmark.')
+    parser.add_argument('--depth', type=int, default=5, help='plies of the search tree to build')
+    parser.add_argument('--copies', type=int, default=100000, help='number of copies to time')
+    args = parser.parse_args(argv)
+
+    root = Connect4()
+    tracemalloc.start()
+    start = timeit.default_timer()
+    nodes = build_tree(root, args.depth)
+    build = timeit.default_timer() - start
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print('tree depth {}: {} instances'.format(args.depth, len(nodes)))
+    print('memory: {:.1f} KiB total, {:.0f} bytes per instance'.format(memory / 1024, memory / len(nodes)))
+    print('build time: {:.1f} ms ({:.2f} us per instance)'.format(1000 * build, 1e6 * build / len(nodes)))
+
+    game = nodes[-1]
+    copy_time = timeit.timeit(lambda: copy(game), number=args.copies)
+    move_time = timeit.timeit(lambda: game.sim_move(game.available_moves[0]), number=args.copies)
+    print('copy: {:.2f} us'.format(1e6 * copy_time / args.copies))
+    print('sim_move: {:.2f} us'.format(1e6 * move_time / args.copies))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,14 @@
 import numpy as np
 import random
-from copy import copy
+from array import array
 from utils import *        
 
 class Connect4:
 
+    # no per-instance __dict__, search trees hold many of these
+    __slots__ = ('size', 'w', 'h', 'N', 'score', 'state', 'heights', 'legal',
+                 'player', 'last_move', 'n_moves')
+
     def __init__(self, size=(7, 6), N=4):
         self.size = size
         self.w, self.h = size
@@ -15,31 +19,60 @@ class Connect4:
             raise ValueError('Game cannot initialize with a {0:d}x{1:d} grid, and winning condition {2:d} in a row'.format(self.w, self.h, self.N))
  
         self.score = None
-        self.state = np.zeros(size, dtype = np.float)
-        self.openCells = [0]*self.w
-        self.available_moves = list(range(self.w))  # array of possible moves.
+        self.state = np.zeros(size, dtype = np.int8)
+        self.heights = array('B', bytes(self.w))  # number of pieces in each column
+        self.legal = (1 << self.w) - 1  # bit x is set while column x is not full
         self.player = 1
         self.last_move = None
         self.n_moves = 0
 
+    # array of possible moves.
+    @property
+    def available_moves(self):
+        return [x for x in range(self.w) if self.legal >> x & 1]
+
+    # copy of the number of pieces in each column
+    @property
+    def openCells(self):
+        return list(self.heights)
 
     # fast deepcopy
+    # subclasses without __slots__ get their own attributes copied too
     def __copy__(self):
         cls = self.__class__
         new_game = cls.__new__(cls)
-        new_game.__dict__.update(self.__dict__)
-
+        new_game.size = self.size
+        new_game.w = self.w
+        new_game.h = self.h
         new_game.N = self.N
         new_game.score = self.score
         new_game.state = self.state.copy()
-        new_game.openCells = copy(self.openCells)
-        new_game.available_moves = copy(self.available_moves)
+        new_game.heights = self.heights[:]
+        new_game.legal = self.legal
         new_game.n_moves = self.n_moves
         new_game.last_move = self.last_move
         new_game.player = self.player
+        if cls is not Connect4 and hasattr(self, '__dict__'):
+            new_game.__dict__.update(self.__dict__)
         
         return new_game
-    
+
+    # rebuild a game from a (w, h) board of 0/1/-1 values
+    # used to restore positions sent across processes or read from files
+    @classmethod
+    def from_board(cls, board, player, last_move=None, N=4, score=None):
+        board = np.asarray(board)
+        game = cls(board.shape, N)
+        game.state[:] = board
+        game.heights = array('B', np.count_nonzero(board, axis=1).tolist())
+        game.legal = sum(1 << x for x in range(game.w) if game.heights[x] < game.h)
+        game.n_moves = sum(game.heights)
+        game.player = player
+        game.last_move = last_move
+        game.score = score
+
+        return game
+
     def sim_move(self, move):
         new_game = self.__copy__()
         new_game.move(move)
@@ -63,7 +96,7 @@ class Connect4:
                 return self.player
                     
         # no more moves
-        if np.all(self.state != 0):
+        if not self.legal:
             return 0
 
         return None
@@ -104,31 +137,26 @@ class Connect4:
     
     def move(self, col):
         x = col if col > -1 else self.available_moves[col]
-        success = False
-        if x in self.available_moves:
-            # make a move
-            y = self.openCells[x]
-            self.openCells[x] += 1
-            self.state[x,y]=self.player
-            success = True
-               
-            if self.openCells[x] > 5:
-                self.available_moves.pop(self.available_moves.index(x))
-               
-
-        if success:
-            self.n_moves += 1
-            self.last_move = tuple((x,y))
-            self.score = self.get_score()
-
-            # if game is not over, switch player
-            if self.score is None:
-                self.player *= -1
-               
-            return True
-
-        return False
+        if x >= self.w or not self.legal >> x & 1:
+            return False
+
+        # make a move
+        y = self.heights[x]
+        self.heights[x] = y + 1
+        self.state[x,y]=self.player
+        if y + 1 == self.h:
+            self.legal &= ~(1 << x)
+
+        self.n_moves += 1
+        self.last_move = (x,y)
+        self.score = self.get_score()
+
+        # if game is not over, switch player
+        if self.score is None:
+            self.player *= -1
+
+        return True
     
 
     def available_mask(self):
-        return (np.abs(self.state) != 1).astype(np.uint8)
\ No newline at end of file
+        return (self.state == 0).astype(np.uint8)
\ No newline at end of file
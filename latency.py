@@ -0,0 +1,243 @@
+import cProfile
+import os
+import time
+import timeit
+from copy import copy
+
+import numpy as np
+from agent_host import AgentHost
+
+PERCENTILES = (50, 95, 99)
+
+# CPU time of the calling thread only; time.thread_time needs Python 3.7
+thread_time = getattr(time, 'thread_time', time.process_time)
+
+
+def format_board(state):
+    '''
+    Renders a board as text with the top row first. Player 1 is X, player -1 is O.
+
+    Parameters
+    ----------
+    state : numpy.ndarray
+        The (w, h) board of a `connect4.Connect4` game.
+
+    Returns
+    -------
+    str
+        The rendered board.
+    '''
+
+    symbols = {1: 'X', -1: 'O', 0: '.'}
+    w, h = state.shape
+    rows = []
+    for y in reversed(range(h)):
+        rows.append(' '.join(symbols[int(state[x, y])] for x in range(w)))
+    return '\n'.join(rows)
+
+
+class LatencyRecorder:
+    def __init__(self, n_closest=5, profile_fraction=None, profile_dir='profiles'):
+        '''
+        Records the wall time, CPU time and remaining margin of every agent move
+        so that tail latency can be compared with the time limit. CPU time is
+        that of the searching thread, or that reported by the worker process
+        for agents hosted by `agent_host.AgentHost`.
+
+        Params
+        ----------
+        n_closest : int (optional)
+            Number of moves closest to the time limit listed in the summary.
+
+        profile_fraction : float (optional)
+            When set, any move whose wall time exceeds this fraction of the time
+            limit is replayed under `cProfile` once it has been timed, and the
+            profile is saved. The replay does not affect the recorded times.
+
+        profile_dir : str (optional)
+            Directory where profiles are written.
+        '''
+
+        self.n_closest = n_closest
+        self.profile_fraction = profile_fraction
+        self.profile_dir = profile_dir
+        self.records = []
+
+    def measure(self, player, game, time_limit, search):
+        '''
+        Times a single move and records it.
+
+        Parameters
+        ----------
+        player : object
+            The agent making the move.
+
+        game : `connect4.Connect4`
+            The game before the move is made.
+
+        time_limit : float
+            The time limit for the move in milliseconds.
+
+        search : callable
+            Takes no arguments and returns the agent's move.
+
+        Returns
+        -------
+        int
+            The move returned by `search`.
+        '''
+
+        state = game.state.astype(np.int8)
+        to_move = game.player
+        n_moves = game.n_moves
+        replay = copy(game) if self.profile_fraction is not None else None
+
+        wall_start = timeit.default_timer()
+        cpu_start = thread_time()
+        try:
+            move = search()
+        finally:
+            cpu = 1000 * (thread_time() - cpu_start)
+            wall = 1000 * (timeit.default_timer() - wall_start)
+
+        # hosted searches run in another process, which reports its own CPU time
+        if isinstance(player, AgentHost):
+            cpu = player.last_cpu_millis
+
+        record = {
+            'agent': str(player),
+            'player': to_move,
+            'n_moves': n_moves,
+            'move': move,
+            'wall': wall,
+            'cpu': cpu,
+            'margin': time_limit - wall,
+            'state': state,
+            'profile': None,
+        }
+
+        if replay is not None and wall > self.profile_fraction * time_limit:
+            record['profile'] = self.profile(player, replay, time_limit, len(self.records))
+
+        self.records.append(record)
+        return move
+
+    def profile(self, player, game, time_limit, index):
+        '''
+        Replays a search under `cProfile` and saves the profile.
+
+        Parameters
+        ----------
+        player : object
+            The agent to profile. Hosted agents are replayed in this process.
+
+        game : `connect4.Connect4`
+            A copy of the game before the move.
+
+        time_limit : float
+            The time limit for the move in milliseconds.
+
+        index : int
+            Index of the profiled move, used in the file name.
+
+        Returns
+        -------
+        str
+            Path of the saved profile.
+        '''
+
+        if isinstance(player, AgentHost):
+            player = player.player
+
+        profiler = cProfile.Profile()
+        start = timeit.default_timer()
+        time_left = lambda: time_limit - 1000 * (timeit.default_timer() - start)
+        profiler.enable()
+        try:
+            player.search(game, time_left)
+        finally:
+            profiler.disable()
+
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, 'move{:04d}_ply{:02d}.prof'.format(index, game.n_moves))
+        profiler.dump_stats(path)
+        return path
+
+    def reset(self):
+        self.records = []
+
+    def report(self):
+        '''
+        Aggregates the recorded moves per agent.
+
+        Returns
+        -------
+        dict
+            Maps each agent to the number of moves, the p50/p95/p99/max wall and
+            CPU time in milliseconds and the smallest margin left. CPU figures
+            are left out when no move has a known CPU time.
+        '''
+
+        agents = {}
+        for record in self.records:
+            agents.setdefault((record['agent'], record['player']), []).append(record)
+
+        report = {}
+        for key, records in agents.items():
+            stats = {'moves': len(records)}
+            for field in ('wall', 'cpu'):
+                values = np.array([r[field] for r in records if r[field] is not None])
+                if not len(values):
+                    continue
+                for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+                    stats['{}_p{}'.format(field, p)] = float(value)
+                stats['{}_max'.format(field)] = float(values.max())
+            stats['min_margin'] = min(r['margin'] for r in records)
+            report[key] = stats
+
+        return report
+
+    def closest(self, n=None):
+        '''
+        Returns the records of the moves that came closest to the time limit.
+
+        Parameters
+        ----------
+        n : int (optional)
+            Number of records to return; defaults to `n_closest`.
+        '''
+
+        n = self.n_closest if n is None else n
+        return sorted(self.records, key=lambda r: r['margin'])[:n]
+
+    def summary(self):
+        '''
+        Formats the report and the moves closest to the time limit as text.
+        '''
+
+        lines = []
+        for (agent, player), stats in self.report().items():
+            lines.append('Player {} ({}): {} moves'.format(player, agent, stats['moves']))
+            for field in ('wall', 'cpu'):
+                if '{}_max'.format(field) not in stats:
+                    continue
+                values = ['p{}={:.1f}'.format(p, stats['{}_p{}'.format(field, p)]) for p in PERCENTILES]
+                values.append('max={:.1f}'.format(stats['{}_max'.format(field)]))
+                lines.append('  {:<4} ms: {}'.format(field, ' '.join(values)))
+            lines.append('  min margin: {:.1f} ms'.format(stats['min_margin']))
+
+        closest = self.closest()
+        if closest:
+            lines.append('')
+            lines.append('Moves closest to the time limit:')
+        for record in closest:
+            cpu = 'n/a' if record['cpu'] is None else '{:.1f} ms'.format(record['cpu'])
+            lines.append('Player {} at ply {}: move {}, wall {:.1f} ms, cpu {}, margin {:.1f} ms'.format(
+                record['player'], record['n_moves'], record['move'],
+                record['wall'], cpu, record['margin']))
+            if record['profile'] is not None:
+                lines.append('profile: {}'.format(record['profile']))
+            lines.append(format_board(record['state']))
+            lines.append('')
+
+        return '\n'.join(lines)
@@ -1,29 +1,41 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import timeit
+from concurrent.futures import ThreadPoolExecutor
 from copy import copy
+from matplotlib.backend_bases import TimerBase
+from agent_host import AgentHost
 
 TIME_LIMIT_MILLIS = 250.
+POLL_INTERVAL_MILLIS = 10
+# returned by agent_move when the agent loses on time
+FORFEIT = 'forfeit'
 
 class Play:
     
-    def __init__(self, game, player1=None, player2=None, name='game'):
+    def __init__(self, game, player1=None, player2=None, name='game', recorder=None, headless=False):
         self.original_game = game
+        self.recorder = recorder
         self.game = copy(game)
         self.player1 = player1
         self.player2 = player2
         self.player = self.game.player
         self.end = False
-        self.play()
+        self.executor = None
+        self.pending = None
+        # agent-vs-agent games can be played to the end without a figure
+        if headless:
+            self.fast_forward()
+        else:
+            self.play()
 
     def reset(self):
         self.game = copy(self.original_game)
         self.click_cid = None
+        self.pending = None
         self.end = False
-        
-    def play(self, name='Game'):
-        
-        self.reset()
+
+    def setup_figure(self, name='Game'):
         if self.game.w * self.game.h < 25:
             figsize = (self.game.w / 1.6, self.game.h / 1.6)
 
@@ -52,34 +64,149 @@ class Play:
         for loc in ['top', 'right', 'bottom', 'left']:
             self.ax.spines[loc].set_visible(False)
 
+        # draw the empty board once and blit pieces on top of it afterwards
+        self.artists = []
+        self.fig.canvas.draw()
+        self.blit = self.fig.canvas.supports_blit
+        if self.blit:
+            self.background = self.fig.canvas.copy_from_bbox(self.ax.bbox)
+            self.fig.canvas.mpl_connect('draw_event', self.redraw)
+
+        self.fig.canvas.mpl_connect('close_event', self.close)
+        self.timer = self.fig.canvas.new_timer(interval=POLL_INTERVAL_MILLIS)
+        self.timer.add_callback(self.poll_agent)
+        # non-interactive backends (Agg, inline) hand out timers that never fire
+        self.live = type(self.timer) is not TimerBase
+        
+    def play(self, name='Game'):
+        
+        self.reset()
+        self.setup_figure(name)
+        self.executor = ThreadPoolExecutor(max_workers=1)
 
-        # fully AI game
-        if self.player1 is not None and self.player2 is not None:
+        # without a running event loop agents cannot move in the background
+        if not self.live and self.player1 is not None and self.player2 is not None:
             self.agent_game()
+            self.draw_board()
             return
-        
+
         # at least one human
-        if self.player1 is not None:
-            # first move from AI first
-            succeed = False
-            while not succeed:
-                loc = self.agent_move(self.player1)
-                succeed = self.game.move(loc)
+        if self.player1 is None or self.player2 is None:
+            self.click_cid = self.fig.canvas.mpl_connect('button_press_event', self.click)
+
+        self.next_turn()
 
+    def fast_forward(self):
+        if self.player1 is None or self.player2 is None:
+            raise ValueError('Fast forward needs an agent for both players')
+
+        self.reset()
+        self.agent_game()
+
+    def show(self, name='Game'):
+        # render the current position in one go, e.g. after a headless game
+        self.setup_figure(name)
+        self.draw_board()
+
+    def draw_board(self):
+        for value, c in [(1, 'salmon'), (-1, 'lightskyblue')]:
+            i, j = np.where(self.game.state == value)
+            self.draw_artist(self.ax.scatter(i, j, s=500, marker='o', zorder=3, c=c))
+
+        self.end = False
+        self.draw_winner(self.game.score)
+
+    def current_agent(self):
+        return self.player1 if self.game.player == 1 else self.player2
+
+    def next_turn(self):
+        # start a background search if an agent is to move
+        if self.end or self.current_agent() is None:
+            return
+
+        self.player = self.game.player
+        if not self.live:
+            # answer the human's move right away, the timer would never poll
+            self.apply_agent_move(self.agent_move(self.current_agent()))
+            return
+
+        self.pending = self.executor.submit(self.agent_move, self.current_agent())
+        self.timer.start()
+
+    def poll_agent(self):
+        # deliver a finished search back to the UI loop
+        if self.pending is None or not self.pending.done():
+            return
+
+        self.timer.stop()
+        future, self.pending = self.pending, None
+        try:
+            loc = future.result()
+        except Exception as e:
+            # a crashing agent loses like one that runs out of time
+            print('Error! Player {} loses: {!r}'.format(self.current_agent(), e))
+            loc = FORFEIT
+
+        self.apply_agent_move(loc)
+
+    def apply_agent_move(self, loc):
+        if loc is FORFEIT:
+            self.forfeit()
+            return
+
+        if self.game.move(loc):
             self.draw_move()
-        
-        self.click_cid = self.fig.canvas.mpl_connect('button_press_event', self.click)
+
+        self.next_turn()
+
+    def forfeit(self):
+        # the player to move loses without a piece being placed
+        self.game.score = -self.game.player
+        if self.click_cid is not None:
+            self.fig.canvas.mpl_disconnect(self.click_cid)
+
+        self.end = True
+
+    def close(self, event=None):
+        self.timer.stop()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
 
     def agent_move(self, player, time_limit=TIME_LIMIT_MILLIS):
+        if isinstance(player, AgentHost):
+            player.settle()
+
+        if self.recorder is None:
+            return self.search_move(player, time_limit)
+
+        search = lambda: self.search_move(player, time_limit)
+        return self.recorder.measure(player, self.game, time_limit, search)
+
+    def search_move(self, player, time_limit):
+        # hosted agents enforce their own hard deadline in the host process
+        if isinstance(player, AgentHost):
+            move = player.hosted_move(self.game, time_limit)
+            if move is None:
+                print('Timeout! Player {} loses.'.format(player))
+                return FORFEIT
+
+            return move
+
         time_millis = lambda: 1000 * timeit.default_timer()
         move_start = time_millis()
         time_left = lambda: time_limit - (time_millis() - move_start)
-        move = player.search(self.game, time_left)
+        try:
+            move = player.search(self.game, time_left)
+        except Exception as e:
+            # a crashing agent loses like one that runs out of time
+            print('Error! Player {} loses: {!r}'.format(player, e))
+            return FORFEIT
+
         move_end = time_left()
 
         if move_end < 0:
             print('Timeout! Player {} loses.'.format(player))
-            return False
+            return FORFEIT
 
         return move
 
@@ -92,46 +219,79 @@ class Play:
                 loc = self.agent_move(self.player1)
             else:
                 loc = self.agent_move(self.player2)
+
+            if loc is FORFEIT:
+                self.forfeit()
+                return
                 
             success = self.game.move(loc)
 
             # see if game is done
             if success:
                 score = self.game.score
-                self.draw_move()
 
             else:
                 break
+
+        self.end = True
         
     def draw_move(self):
         if self.end:
             return
         
         i, j = self.game.last_move
-        c = 'salmon' if self.player==1 else 'lightskyblue'
-        self.ax.scatter(i, j, s=500, marker='o', zorder=3, c=c)
+        c = 'salmon' if self.game.state[i, j] == 1 else 'lightskyblue'
+        self.draw_artist(self.ax.scatter(i, j, s=500, marker='o', zorder=3, c=c))
         score = self.game.score
         self.draw_winner(score)
-        self.fig.canvas.draw()
 
+    def draw_artist(self, artist):
+        self.artists.append(artist)
+        if not self.blit:
+            self.fig.canvas.draw_idle()
+            return
+
+        # only the new artist is drawn, the background already holds the others
+        artist.set_animated(True)
+        self.fig.canvas.restore_region(self.background)
+        self.ax.draw_artist(artist)
+        self.fig.canvas.blit(self.ax.bbox)
+        self.background = self.fig.canvas.copy_from_bbox(self.ax.bbox)
+
+    def redraw(self, event):
+        # a full redraw (e.g. resize) skips animated artists, so add them back
+        self.background = self.fig.canvas.copy_from_bbox(self.ax.bbox)
+        for artist in self.artists:
+            self.ax.draw_artist(artist)
+        self.fig.canvas.blit(self.ax.bbox)
+        self.background = self.fig.canvas.copy_from_bbox(self.ax.bbox)
 
     def draw_winner(self, score):
         if score is None:
             return
         
         if score == -1 or score == 1:
-            locs = self.game.get_winning_loc()
+            locs = np.asarray(self.game.get_winning_loc())
             c = 'darkred' if score == 1 else 'darkblue'
-            self.ax.scatter(locs[:,0],locs[:,1], s=300, marker='*',c=c,zorder=4)
+            # a game lost on time has no winning line to mark
+            if len(locs):
+                self.draw_artist(self.ax.scatter(locs[:,0],locs[:,1], s=300, marker='*',c=c,zorder=4))
 
         # try to disconnect if game is over
-        if hasattr(self, 'click_cid'):
+        if self.click_cid is not None:
             self.fig.canvas.mpl_disconnect(self.click_cid)
 
         self.end=True
         
     
     def click(self, event):
+        # ignore clicks outside the board or while an agent is thinking
+        if self.end or self.pending is not None or event.xdata is None:
+            return
+
+        if self.current_agent() is not None:
+            return
+
         col = int(round(event.xdata))
         self.player = self.game.player
         succeed = self.game.move(col)
@@ -141,15 +301,5 @@ class Play:
 
         else:
             return
-        
-        if self.player1 is not None or self.player2 is not None:
-            succeed = False
-            self.player = self.game.player
-            while not succeed:
-                if self.game.player == 1:
-                    col = self.agent_move(self.player1)
-                else:
-                    col = self.agent_move(self.player2)
-                succeed = self.game.move(col)
-               
-            self.draw_move()
\ No newline at end of file
+
+        self.next_turn()
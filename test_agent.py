@@ -32,6 +32,9 @@ class MinimaxPlayer:
         self.search_depth = search_depth
         self.score = score_cls.get_score
         self.TIMER_THRESHOLD = timeout
+        # optional callback receiving the best move after each completed depth,
+        # set by `agent_host.AgentHost` when the player runs in a worker process
+        self.report_move = None
 
     def search(self, game, time_left):
         '''
@@ -62,6 +65,8 @@ class MinimaxPlayer:
         while True:
             try:
                 best_move = self.minimax(game, depth)
+                if self.report_move is not None:
+                    self.report_move(best_move)
                 depth += 1
 
             except SearchTimeout:
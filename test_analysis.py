@@ -0,0 +1,78 @@
+import asyncio
+import json
+
+import pytest
+from agent_host import encode_state
+from analysis import AnalysisServer, analyse_position, parse_position
+
+
+def analyse_moves(moves, depth=4):
+    game = parse_position({'moves': moves})
+    return analyse_position(game.size, game.N, encode_state(game), depth=depth)
+
+
+class Writer:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines.append(json.loads(data.decode()))
+
+    async def drain(self):
+        pass
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = AnalysisServer(workers=1)
+    yield server
+    server.close()
+
+
+def respond(server, request):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    writer = Writer()
+    try:
+        loop.run_until_complete(server.respond(json.dumps(request).encode(), writer, asyncio.Lock()))
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+    return writer.lines[0]
+
+
+@pytest.mark.parametrize('moves, winning_move', [
+    ('112233', 3),   # player 1 completes the bottom row
+    ('2121213', 0),  # player -1 completes the first column
+])
+def test_win_in_one(moves, winning_move):
+    move, score, depth = analyse_moves(moves)
+    assert (move, score, depth) == (winning_move, float('inf'), 1)
+
+
+def test_forced_loss_for_side_to_move():
+    # player -1 cannot block both ends of player 1's open three
+    _, score, depth = analyse_moves('22334')
+    assert (score, depth) == (float('-inf'), 2)
+
+
+def test_respond_reports_result_for_side_to_move(server):
+    response = respond(server, {'id': 7, 'moves': '2121213', 'depth': 3})
+    assert response['id'] == 7
+    assert (response['move'], response['result'], response['score']) == (0, 'win', None)
+
+
+@pytest.mark.parametrize('request_', [
+    {'moves': [200], 'size': [300, 6], 'depth': 1},
+    {'moves': '44', 'size': [7]},
+    {'moves': '44', 'N': '4'},
+    {'moves': '44', 'depth': 0},
+    {'moves': '44', 'depth': True},
+    {'moves': '44', 'time': -5},
+    {'moves': '44', 'time': 'soon'},
+    {'moves': ['a']},
+    [1, 2],
+])
+def test_bad_request_gets_an_error(server, request_):
+    response = respond(server, request_)
+    assert response['error']